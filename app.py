@@ -1,25 +1,59 @@
+import atexit
+import gzip
+import hashlib
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
 import time
-from flask import Flask, jsonify, g, request, send_from_directory
+from functools import lru_cache
+from itertools import combinations
+from flask import Flask, Response, jsonify, g, request
+from flask.json.provider import JSONProvider
 from flask_swagger_ui import get_swaggerui_blueprint
+import orjson
 import sqlite3
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, so jsonify (and request.json) skip the stdlib json encoder."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 DATABASE = 'states.db'
 
 def setup_logging():
     # Set up a log file that rotates (so it doesn't grow forever)
-    handler = RotatingFileHandler('api.log', maxBytes=100000, backupCount=1)
+    handler = RotatingFileHandler('api.log', maxBytes=5_000_000, backupCount=1)
     handler.setLevel(logging.INFO)
     formatter = logging.Formatter(
         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
     )
     handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
+
+    # Requests only put the records on a queue; a background thread writes them to the file
+    log_queue = SimpleQueue()
+    app.logger.addHandler(QueueHandler(log_queue))
     app.logger.setLevel(logging.INFO)
 
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    # Flush what is still queued when the server stops
+    atexit.register(listener.stop)
+
 setup_logging()
 
 @app.before_request
@@ -50,21 +84,29 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
-def get_db():
+# The API only reads the database, so every worker thread keeps one read-only connection open
+_local = threading.local()
+
 
-    db = getattr(g, '_database', None)
+def get_db():
+    """Return this thread's read-only database connection (opened on first use)."""
+    db = getattr(_local, 'db', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True, check_same_thread=False)
         db.row_factory = sqlite3.Row
+        db.execute('PRAGMA query_only = 1')
+        db.execute('PRAGMA mmap_size = 268435456')
+        db.execute('PRAGMA cache_size = -20000')
+        _local.db = db
     return db
 
 
-@app.teardown_appcontext
-def close_connection(exception):
-    """Closes the database connection automatically when request is done."""
-    db = getattr(g, '_database', None)
+def close_db():
+    """Close this thread's database connection, if it opened one."""
+    db = getattr(_local, 'db', None)
     if db is not None:
         db.close()
+        _local.db = None
 
 
 @app.route('/')
@@ -82,16 +124,40 @@ def home():
     })
 
 
-@app.route('/api/countries', methods=['GET'])
-def get_all_countries():
+# The database is built offline (crawler + database_manager) and the API never writes to it,
+# so the read-only endpoints cache their serialized JSON instead of re-running the queries.
+def json_response(body, status=200):
+    """Wrap an already serialized JSON body in a response."""
+    return Response(body, status=status, mimetype='application/json')
+
+
+def precompress(body):
+    """Return (body, gzipped body), so the compression is done once and not per request."""
+    return body, gzip.compress(body, 6)
+
+
+def precompressed_response(payload):
+    """Serve a precompress() payload, gzipped when the client accepts it."""
+    body, gzipped = payload
+    if request.accept_encodings['gzip'] > 0:
+        response = json_response(gzipped)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = json_response(body)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@lru_cache(maxsize=None)
+def _all_countries_payload():
     cur = get_db().cursor()
     cur.execute("SELECT id, name, capital, population, area_km2, density FROM countries")
     rows = cur.fetchall()
-    return jsonify([dict(row) for row in rows])
+    return precompress(orjson.dumps([dict(row) for row in rows]))
 
 
-@app.route('/api/countries/top-10-population', methods=['GET'])
-def get_top_population():
+@lru_cache(maxsize=None)
+def _top_population_payload():
     cur = get_db().cursor()
     cur.execute('''
         SELECT name, population, density, area_km2 
@@ -99,11 +165,11 @@ def get_top_population():
         ORDER BY population DESC LIMIT 10
     ''')
     rows = cur.fetchall()
-    return jsonify([dict(row) for row in rows])
+    return precompress(orjson.dumps([dict(row) for row in rows]))
 
 
-@app.route('/api/countries/top-10-density', methods=['GET'])
-def get_top_density():
+@lru_cache(maxsize=None)
+def _top_density_payload():
     cur = get_db().cursor()
     cur.execute('''
         SELECT name, density, population, area_km2 
@@ -111,10 +177,11 @@ def get_top_density():
         ORDER BY density DESC LIMIT 10
     ''')
     rows = cur.fetchall()
-    return jsonify([dict(row) for row in rows])
+    return precompress(orjson.dumps([dict(row) for row in rows]))
 
-@app.route('/api/countries/top-10-language', methods=['GET'])
-def get_top_language():
+
+@lru_cache(maxsize=None)
+def _top_language_payload():
     cur = get_db().cursor()
     cur.execute('''
         SELECT l.name, SUM(c.population) as total_reach
@@ -126,53 +193,132 @@ def get_top_language():
         LIMIT 10
     ''')
     rows = cur.fetchall()
-    return jsonify([dict(row) for row in rows])
-
-@app.route('/api/statistics', methods=['GET'])
-def get_stats():
-    cur = get_db().cursor()
-    stats = {}
-
-    # Total Countries
-    cur.execute("SELECT COUNT(*) as total_countries FROM countries")
-    stats['total_countries'] = cur.fetchone()['total_countries']
+    return precompress(orjson.dumps([dict(row) for row in rows]))
 
-    # Total Population
-    cur.execute("SELECT SUM(population) as total_population FROM countries")
-    stats['total_population'] = cur.fetchone()['total_population']
 
-    # Average Density
-    cur.execute("SELECT AVG(density) as average_density FROM countries WHERE density IS NOT NULL")
-    stats['average_density'] = cur.fetchone()['average_density']
+@lru_cache(maxsize=None)
+def _stats_payload():
+    cur = get_db().cursor()
+    # All the stats in one pass over the table (AVG already skips NULL densities)
+    cur.execute('''
+        SELECT COUNT(*) as total_countries,
+               SUM(population) as total_population,
+               AVG(density) as average_density
+        FROM countries
+    ''')
+    stats = dict(cur.fetchone())
 
-    return jsonify(stats)
+    return precompress(orjson.dumps(stats))
 
 
-@app.route('/api/country/<string:country_name>', methods=['GET'])
-def get_country_details(country_name):
+@lru_cache(maxsize=256)
+def _country_details_json(country_name):
+    """Serialized details of a country, or None if there is no such country."""
     cur = get_db().cursor()
-    cur.execute("SELECT * FROM countries WHERE name LIKE ?", (country_name,))
+    # Country row + its languages and neighbors (as JSON arrays) in a single query.
+    # The neighbors keep their page order (borders.id)
+    cur.execute('''
+        SELECT c.*,
+            (SELECT json_group_array(l.name) FROM languages l
+             JOIN country_languages cl ON l.id = cl.language_id
+             WHERE cl.country_id = c.id) AS languages,
+            (SELECT json_group_array(neighbor_name) FROM
+                (SELECT neighbor_name FROM borders WHERE country_id = c.id ORDER BY id)) AS neighbors
+        FROM countries c WHERE c.name = ? COLLATE NOCASE LIMIT 1
+    ''', (country_name,))
     country = cur.fetchone()
 
     if country is None:
-        app.logger.warning(f"404 Not Found: Country '{country_name}'")
-        return jsonify({"error": "Country not found"}), 404
+        return None
 
     country_dict = dict(country)
+    country_dict['languages'] = json.loads(country_dict['languages'] or '[]')
+    country_dict['neighbors'] = json.loads(country_dict['neighbors'] or '[]')
 
-    # Languages
-    cur.execute('''
-        SELECT l.name FROM languages l
-        JOIN country_languages cl ON l.id = cl.language_id
-        WHERE cl.country_id = ?
-    ''', (country_dict['id'],))
-    country_dict['languages'] = [row['name'] for row in cur.fetchall()]
+    return orjson.dumps(country_dict)
+
+
+# Search filters, in the order their conditions (and parameters) appear: (name, join, condition)
+_SEARCH_FILTERS = (
+    ('language',
+     "JOIN country_languages cl ON c.id = cl.country_id JOIN languages l ON cl.language_id = l.id",
+     "l.name LIKE ?"),
+    ('neighbor', "JOIN borders b ON c.id = b.country_id", "b.neighbor_name LIKE ?"),
+    ('political_system', None, "c.political_system LIKE ?"),
+    ('timezone', None, "c.timezone LIKE ?"),
+)
+
+
+def _build_search_sql(names):
+    """SQL for a search using the given filter names."""
+    used = [f for f in _SEARCH_FILTERS if f[0] in names]
+    joins = [join for _, join, _ in used if join]
+    conditions = [condition for _, _, condition in used]
+
+    full_sql = "SELECT DISTINCT c.name, c.capital, c.population FROM countries c"
+    if joins: full_sql += " " + " ".join(joins)
+    if conditions: full_sql += " WHERE " + " AND ".join(conditions)
+    full_sql += " ORDER BY c.name"
+    return full_sql
+
+
+# There are only 2^4 combinations of filters, so all the statements are built once (and the
+# same text is always reused, which keeps sqlite3's statement cache warm)
+_SEARCH_SQL = {
+    frozenset(names): _build_search_sql(names)
+    for r in range(len(_SEARCH_FILTERS) + 1)
+    for names in combinations([f[0] for f in _SEARCH_FILTERS], r)
+}
+
+
+@lru_cache(maxsize=256)
+def _search_json(language, neighbor, political, timezone):
+    values = zip((f[0] for f in _SEARCH_FILTERS), (language, neighbor, political, timezone))
+    active = [(name, value) for name, value in values if value]
+
+    full_sql = _SEARCH_SQL[frozenset(name for name, _ in active)]
+    params = [f"%{value}%" for _, value in active]
+
+    cur = get_db().cursor()
+    cur.execute(full_sql, params)
+    rows = cur.fetchall()
+    return orjson.dumps([dict(row) for row in rows])
+
+
+@app.route('/api/countries', methods=['GET'])
+def get_all_countries():
+    return precompressed_response(_all_countries_payload())
+
+
+@app.route('/api/countries/top-10-population', methods=['GET'])
+def get_top_population():
+    return precompressed_response(_top_population_payload())
+
+
+@app.route('/api/countries/top-10-density', methods=['GET'])
+def get_top_density():
+    return precompressed_response(_top_density_payload())
+
+@app.route('/api/countries/top-10-language', methods=['GET'])
+def get_top_language():
+    return precompressed_response(_top_language_payload())
+
+@app.route('/api/statistics', methods=['GET'])
+def get_stats():
+    return precompressed_response(_stats_payload())
 
-    # Neighbors
-    cur.execute('SELECT neighbor_name FROM borders WHERE country_id = ?', (country_dict['id'],))
-    country_dict['neighbors'] = [row['neighbor_name'] for row in cur.fetchall()]
 
-    return jsonify(country_dict)
+@app.route('/api/country/<string:country_name>', methods=['GET'])
+def get_country_details(country_name):
+    # Wikipedia style slugs (United_States) are accepted too. Only the underscores are replaced,
+    # so the lookup stays an exact NOCASE match and keeps using idx_name_nocase
+    body = _country_details_json(country_name.replace('_', ' '))
+
+    if body is None:
+        app.logger.warning(f"404 Not Found: Country '{country_name}'")
+        return jsonify({"error": "Country not found"}), 404
+
+    return json_response(body)
 
 
 @app.route('/api/countries/search', methods=['GET'])
@@ -182,47 +328,41 @@ def search_countries():
     political = request.args.get('political_system')
     timezone = request.args.get('timezone')
 
-    query = "SELECT DISTINCT c.name, c.capital, c.population FROM countries c"
-    params = []
-    conditions = []
-    joins = []
+    try:
+        return json_response(_search_json(language, neighbor, political, timezone))
+    except sqlite3.Error as e:
+        app.logger.error(f"Search Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-    if language:
-        joins.append("JOIN country_languages cl ON c.id = cl.country_id JOIN languages l ON cl.language_id = l.id")
-        conditions.append("l.name LIKE ?")
-        params.append(f"%{language}%")
+def _load_static(filename):
+    """Read a file from static/ once, returning its bytes and an ETag for it."""
+    with open(os.path.join(app.root_path, 'static', filename), 'rb') as f:
+        data = f.read()
+    return data, hashlib.md5(data).hexdigest()
 
-    if neighbor:
-        joins.append("JOIN borders b ON c.id = b.country_id")
-        conditions.append("b.neighbor_name LIKE ?")
-        params.append(f"%{neighbor}%")
 
-    if political:
-        conditions.append("c.political_system LIKE ?")
-        params.append(f"%{political}%")
+# Small files requested all the time: kept in memory instead of being read from disk per request
+_FAVICON, _FAVICON_ETAG = _load_static('favicon.ico')
+_SWAGGER, _SWAGGER_ETAG = _load_static('swagger.json')
 
-    if timezone:
-        conditions.append("c.timezone LIKE ?")
-        params.append(f"%{timezone}%")
 
-    full_sql = query
-    if joins: full_sql += " " + " ".join(joins)
-    if conditions: full_sql += " WHERE " + " AND ".join(conditions)
-    full_sql += " ORDER BY c.name"
+def static_bytes_response(data, etag, mimetype):
+    """Serve in-memory static content, answering 304 when the client's ETag still matches."""
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 604800
+    return response.make_conditional(request)
 
-    cur = get_db().cursor()
-    try:
-        cur.execute(full_sql, params)
-        rows = cur.fetchall()
-        return jsonify([dict(row) for row in rows])
-    except sqlite3.Error as e:
-        app.logger.error(f"Search Error: {e}")
-        return jsonify({"error": str(e)}), 500
 
 @app.route('/favicon.ico')
 def favicon():
-    return send_from_directory(os.path.join(app.root_path, 'static'),
-                               'favicon.ico', mimetype='image/vnd.microsoft.icon')
+    return static_bytes_response(_FAVICON, _FAVICON_ETAG, 'image/vnd.microsoft.icon')
+
+
+@app.route(API_URL)
+def swagger_spec():
+    return static_bytes_response(_SWAGGER, _SWAGGER_ETAG, 'application/json')
 
 
 # --- ERROR HANDLERS ---
@@ -237,5 +377,21 @@ def internal_error(error):
     return jsonify({"error": "Internal Server Error", "status": 500}), 500
 
 
+def warm_caches():
+    """Build the static payloads at startup, so no request has to pay for the first query."""
+    try:
+        for build in (_all_countries_payload, _top_population_payload, _top_density_payload,
+                      _top_language_payload, _stats_payload):
+            build()
+    finally:
+        # The main thread doesn't serve requests, so its connection isn't needed after this
+        close_db()
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    debug = True
+    # With the reloader this file also runs in the watcher process, which never serves a request.
+    # Only warm up in the serving process (the reloader sets WERKZEUG_RUN_MAIN there)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_caches()
+    app.run(debug=debug, port=5000)
\ No newline at end of file
@@ -1,29 +1,151 @@
 
-import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
+from concurrent.futures import ThreadPoolExecutor
+import os
 import re
 import json
 
+# Country pages are fetched concurrently (the scraping is network bound)
+MAX_WORKERS = 16
+
+# Wikipedia responses are cached on disk (wiki_cache.sqlite next to this file, wherever the
+# scraper is run from), so re-runs don't download everything again
+CACHE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wiki_cache')
+CACHE_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+
+# Patterns used while parsing, compiled once
+_RE_BRACKETS = re.compile(r'\[.*?\]')
+_RE_PARENS = re.compile(r'\(.*?\)')
+_RE_WS = re.compile(r'\s+')
+_RE_NUM = re.compile(r'(\d+(\.\d+)?)')
+_RE_FLOAT = re.compile(r'\d+(\.\d+)?')
+# Notes right after a number that are followed by more of it: "3.[1]02", "12[a](b).5"
+_RE_GLUED_NOTE = re.compile(r'\.?(?:\[.*?\]|\(.*?\))+[\d.]')
+_RE_TZ_SPLIT = re.compile(r'[\[\(]')
+_RE_UTC = re.compile(r'UTC[+-]\d+')
+
+# Used to cut the tables we need out of the raw page, so only they go through the HTML parser
+_RE_INFOBOX_START = re.compile(rb'<table\b[^>]*\bclass="[^"]*\binfobox(?=[\s"])', re.I)
+_RE_WIKITABLE_START = re.compile(rb'<table\b[^>]*\bclass="[^"]*\bwikitable(?=[\s"])', re.I)
+_RE_TABLE_TAG = re.compile(rb'<(/?)table\b[^>]*>', re.I)
+_RE_H1 = re.compile(rb'<h1\b[\s\S]*?</h1>', re.I)
+
+# Language cells: punctuation removed from every item, and items that are not languages.
+# ("List" and "locally" are checked as substrings, ";" and ":" can't survive the strip)
+_STRIP_LANG_PUNCT = str.maketrans('', '', ';:')
+_EXCLUDED_LANG_WORDS = frozenset(['(de facto)', 'None', 'Languages', 'Official', '[hide]'])
+
+# Every ASCII byte except a-z, deleted by bytes.translate when normalizing headers
+_NON_AZ_BYTES = bytes(c for c in range(128) if not 97 <= c <= 122)
+
+
+def _letters_only(text):
+    """Keep only the a-z characters of text (same result as re.sub(r'[^a-z]', '', text))."""
+    return text.encode('ascii', 'ignore').translate(None, _NON_AZ_BYTES).decode('ascii')
+
+
+def _iter_tables(html, start_re):
+    """Yield the raw bytes of every <table> whose opening tag matches start_re, nested tables included."""
+    pos = 0
+    while True:
+        match = start_re.search(html, pos)
+        if not match:
+            return
+
+        depth = 0
+        end = len(html)
+        for tag in _RE_TABLE_TAG.finditer(html, match.start()):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                end = tag.end()
+                break
+
+        yield html[match.start():end]
+        pos = end
+
+
+def _first_table(html, start_re):
+    return next(_iter_tables(html, start_re), None)
+
+
+def _classify_header(header):
+    """Return the data fields an infobox row with this (normalized) header fills, in parsing order."""
+    fields = []
+    if "capital" in header:
+        fields.append('capital')
+    if "government" in header and "transitional" not in header:
+        fields.append('political_system')
+    if "population" in header or "estimate" in header or "census" in header:
+        fields.append('population')
+    if "density" in header:
+        fields.append('density')
+    if "area" in header:
+        fields.append('area')
+    elif "total" in header:
+        fields.append('total')
+    if "officiallanguage" in header or "officialandnational" in header or "nationallanguage" in header:
+        fields.append('language')
+    if "timezone" in header:
+        fields.append('timezone')
+    return tuple(fields)
+
+
+# Normalized header -> fields, filled as headers are seen. Infobox headers are a small
+# closed vocabulary, so after the first few pages every row is a single dict lookup.
+_HEADER_FIELDS = {}
+
 
 class CountryScraper:
-    def __init__(self):
+    def __init__(self, session=None):
+        """session: the requests session to fetch with (the tests pass one that doesn't touch the disk cache)."""
         self.base_url = "https://en.wikipedia.org"
         self.headers = {'User-Agent': 'StatesOfTheWorldAgent/1.0 (student_project_fii)'}
 
+        # One shared (cached) session so the connections to wikipedia are reused between requests
+        if session is None:
+            session = requests_cache.CachedSession(
+                CACHE_NAME,
+                backend='sqlite',
+                expire_after=CACHE_EXPIRE_SECONDS,
+                allowable_codes=(200,)
+            )
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+            session.mount('https://', adapter)
+        self.session = session
+        self.session.headers.update(self.headers)
+
         self.neighbors_map = {}
+        # Lookup helpers for the fuzzy neighbors search, filled by build_neighbors_map
+        self._neighbors_keys_lc = {}
+        self._neighbors_keys_sorted = []
 
     def clean_text(self, text):
         if not text:
             return None
         # Remove references
-        text = re.sub(r'\[.*?\]', '', text)
-        text = re.sub(r'\(.*?\)', '', text)
+        text = _RE_BRACKETS.sub('', text)
+        text = _RE_PARENS.sub('', text)
         # Fix: Replace newlines with space to handle "List\nUTC+1"
         text = text.replace('\n', ' ')
         # Fix: Remove multiple spaces
-        text = re.sub(r'\s+', ' ', text)
+        text = _RE_WS.sub(' ', text)
         return text.strip()
 
+    def _search_number(self, pattern, text):
+        """First number of the cell, not counting references and notes like "[1]" or "(2020 census)"."""
+        text = text.replace(",", "")
+        match = pattern.search(text)
+        # Usually the value comes first and the notes later ("19,053,815[5] (63rd)"), so the full
+        # clean_text is only needed when a note starts before the number found, or when removing
+        # the notes right after it would join it with more digits ("3.[1]02" -> "3.02")
+        if match:
+            start = match.start()
+            if '[' in text[:start] or '(' in text[:start] or _RE_GLUED_NOTE.match(text, match.end()):
+                match = pattern.search(self.clean_text(text))
+        return match
+
     def parse_number(self, text):
         if not text: return None
 
@@ -36,9 +158,7 @@ class CountryScraper:
         elif 'trillion' in text_lower:
             multiplier = 1_000_000_000_000
 
-        clean_str = self.clean_text(text)
-
-        match = re.search(r'(\d+(\.\d+)?)', clean_str.replace(",", ""))
+        match = self._search_number(_RE_NUM, text)
 
         if match:
             try:
@@ -52,9 +172,8 @@ class CountryScraper:
 
     def parse_float(self, text):
         if not text: return None
-        clean_str = self.clean_text(text)
 
-        match = re.search(r'\d+(\.\d+)?', clean_str.replace(",", ""))
+        match = self._search_number(_RE_FLOAT, text)
         if match:
             try:
                 return float(match.group(0))
@@ -65,28 +184,26 @@ class CountryScraper:
     def parse_languages(self, td):
         if not td: return None
 
-        for sup in td.find_all('sup'):
+        for sup in td.css('sup'):
             sup.decompose()
 
-        text = td.get_text(separator='|')
-
-        excluded_words = ['List', 'List:', '(de facto)', 'None', 'Languages', 'Official', 'locally', ';', '[hide]']
+        text = td.text(separator='|')
 
         langs = []
         for item in text.split('|'):
 
-            clean_item = item.replace(';', '').replace(':', '').strip()
+            clean_item = item.translate(_STRIP_LANG_PUNCT).strip()
 
 
             if (len(clean_item) > 2 and
-                    clean_item not in excluded_words and
+                    clean_item not in _EXCLUDED_LANG_WORDS and
                     "List" not in clean_item and
                     "locally" not in clean_item and
                     not clean_item[0].isdigit()):
 
                 langs.append(clean_item)
 
-        return ", ".join(list(set(langs)))
+        return ", ".join(dict.fromkeys(langs))
 
     def build_neighbors_map(self):
         """
@@ -99,43 +216,42 @@ class CountryScraper:
         print(f"Build neighbors map from: {full_url}")
 
         try:
-            response = requests.get(full_url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
+            response = self.session.get(full_url, timeout=10)
             # The sortable table
-            table = soup.find('table', {'class': 'wikitable'})
+            table_html = _first_table(response.content, _RE_WIKITABLE_START)
+            table = LexborHTMLParser(table_html).css_first('table.wikitable') if table_html else None
             if not table:
                 print("Can't find the sortable table.")
                 return
 
-            rows = table.find_all('tr')
+            rows = table.css('tr')
             print(f"Rows founded in the neighbors table: {len(rows)}")
 
             for tr in rows[1:]:  # Skip the header
                 # Wikipedia stores the name of the country in table_header and sometimes in table_data
-                cells = tr.find_all(['td', 'th'])
+                cells = tr.css('td, th')
 
                 # Need at least 2 colls (name and neighbors)
                 if not cells or len(cells) < 4:
                     continue
 
                 # Extract the name of the state (first cell)
-                country_link = cells[0].find('a')
+                country_link = cells[0].css_first('a')
                 if not country_link:
                     continue
-                country_name = self.clean_text(country_link.get_text())
+                country_name = self.clean_text(country_link.text())
 
                 # Extract the neighbors (last cell)
                 neighbors_cell = cells[-1]
 
-                neighbor_links = neighbors_cell.find_all('a')
+                neighbor_links = neighbors_cell.css('a')
                 neighbors_list = []
 
                 # ignored = ["citation needed", "note", "[", "]", "north", "south", "east", "west"]
 
                 for link in neighbor_links:
-                    n_name = link.get_text().strip()
-                    n_href = link.get('href', '')
+                    n_name = link.text().strip()
+                    n_href = link.attributes.get('href') or ''
 
                     # Validations
                     if (n_name and
@@ -145,21 +261,94 @@ class CountryScraper:
                             # and not any(x in n_name.lower() for x in ignored)):
                         neighbors_list.append(n_name)
 
-                # Delete duplicates
-                self.neighbors_map[country_name] = list(set(neighbors_list))
+                # Delete duplicates (keeping the page order)
+                self.neighbors_map[country_name] = list(dict.fromkeys(neighbors_list))
 
+            self._index_neighbors_map()
             print(f"Neighbors map successfully built: {len(self.neighbors_map)} countries.")
             # print(self.neighbors_map)
 
         except Exception as e:
             print(f"Error creating the neighbors map: {e}")
 
+    # --- Infobox row parsers (picked by _classify_header) ---
+    # td_text is the text of the row's cell, extracted once per row by get_country_data
+    def _parse_capital_row(self, td, td_text, data):
+        capital_link = td.css_first('a')
+        if capital_link:
+            data['capital'] = capital_link.text()
+        else:
+            data['capital'] = self.clean_text(td_text.split(';')[0])
+
+    def _parse_political_system_row(self, td, td_text, data):
+        if data['political_system'] is None:
+            link_texts = [a.text() for a in td.css('a')]
+            # Filter out references [1] and citations
+            valid_links = [
+                t for t in link_texts
+                if not t.startswith('[') and not t[0].isdigit()
+            ]
+
+            if valid_links:
+                data['political_system'] = ", ".join(valid_links)
+            else:
+                text = self.clean_text(td_text)
+                # Double check: don't save if it looks like a date (starts with digit)
+                if text and not text[0].isdigit():
+                    data['political_system'] = text
+
+    def _parse_population_row(self, td, td_text, data):
+        if data['population'] is None:
+            data['population'] = self.parse_number(td_text)
+
+    def _parse_density_row(self, td, td_text, data):
+        data['density'] = self.parse_float(td_text)
+
+    def _parse_area_row(self, td, td_text, data):
+        if data['area_in_km2'] is None:
+            data['area_in_km2'] = self.parse_number(td_text)
+
+    def _parse_total_row(self, td, td_text, data):
+        # A plain "Total" row is only the area when the value is given in km
+        if "km" in td_text.lower():
+            self._parse_area_row(td, td_text, data)
+
+    def _parse_language_row(self, td, td_text, data):
+        data['language'] = self.parse_languages(td)
+
+    def _parse_timezone_row(self, td, td_text, data):
+        if "List" in td_text:
+            # Extragem doar partea de UTC
+            match = _RE_UTC.search(td_text)
+            if match:
+                data['timezone'] = match.group(0)
+                return
+
+        cleaned_tz = _RE_TZ_SPLIT.split(td_text)[0]
+        data['timezone'] = self.clean_text(cleaned_tz)
+
+    _ROW_PARSERS = {
+        'capital': _parse_capital_row,
+        'political_system': _parse_political_system_row,
+        'population': _parse_population_row,
+        'density': _parse_density_row,
+        'area': _parse_area_row,
+        'total': _parse_total_row,
+        'language': _parse_language_row,
+        'timezone': _parse_timezone_row,
+    }
+
+    def _index_neighbors_map(self):
+        """Index the neighbors map keys by lowercase name, longest names first for the fuzzy search."""
+        self._neighbors_keys_lc = {k.lower(): k for k in self.neighbors_map if k}
+        self._neighbors_keys_sorted = sorted(self._neighbors_keys_lc, key=len, reverse=True)
+
     def get_country_data(self, country_url):
         full_url = self.base_url + country_url
         print(f"Scraping: {full_url}")  # Debug print
 
         try:
-            response = requests.get(full_url, headers=self.headers, timeout=10)
+            response = self.session.get(full_url, timeout=10)
         except Exception as e:
             print(f"Connection error: {e}")
             return None
@@ -168,8 +357,11 @@ class CountryScraper:
             print(f"Error status code {response.status_code}")
             return None
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        infobox = soup.find('table', {'class': 'infobox'})
+        # Only the infobox (and the title, as a fallback for the name) is parsed, not the whole article
+        html = response.content
+        infobox_html = _first_table(html, _RE_INFOBOX_START)
+
+        infobox = LexborHTMLParser(infobox_html).css_first('table.infobox') if infobox_html else None
         if not infobox:
             print("Infobox not found")
             return None
@@ -186,13 +378,16 @@ class CountryScraper:
             "political_system": None
         }
 
-        fn_org = infobox.find('div', {'class': 'fn org'})
+        fn_org = infobox.css_first('div.fn.org')
         if fn_org:
-            data['name'] = self.clean_text(fn_org.get_text())
+            data['name'] = self.clean_text(fn_org.text())
         else:
-            h1 = soup.find('h1')
-            if h1:
-                data['name'] = self.clean_text(h1.get_text())
+            # The title is only looked for when the infobox has no name
+            h1_match = _RE_H1.search(html)
+            if h1_match:
+                h1 = LexborHTMLParser(h1_match.group(0)).css_first('h1')
+                if h1:
+                    data['name'] = self.clean_text(h1.text())
 
         if not data['name']:
             print(f"SKIPPING: Couldn't idetinfy the name for {country_url}")
@@ -201,82 +396,33 @@ class CountryScraper:
         if data['name'] in self.neighbors_map:
             data['neighbors'] = self.neighbors_map[data['name']]
         else:
-            # Fuzzy search
-            for k in self.neighbors_map:
-                if k and (data['name'] in k or k in data['name']):
-                    data['neighbors'] = self.neighbors_map[k]
-                    break
-
-        rows = infobox.find_all('tr')
+            # Fuzzy search (case insensitive, the longest matching name wins)
+            name_lc = data['name'].lower()
+            key = self._neighbors_keys_lc.get(name_lc)
+            if key is None:
+                for k in self._neighbors_keys_sorted:
+                    if name_lc in k or k in name_lc:
+                        key = self._neighbors_keys_lc[k]
+                        break
+            if key is not None:
+                data['neighbors'] = self.neighbors_map[key]
+
+        rows = infobox.css('tr')
         for tr in rows:
-            th = tr.find('th')
-            td = tr.find('td')
+            th = tr.css_first('th')
+            td = tr.css_first('td')
             if not th or not td: continue
 
-            header_clean = re.sub(r'[^a-z]', '', th.get_text().lower())
-
-            # --- CAPITAL ---
-            if "capital" in header_clean:
-                if td.find('a'):
-                    data['capital'] = td.find('a').get_text()
-                else:
-                    data['capital'] = self.clean_text(td.get_text().split(';')[0])
-
-            # --- POLITICAL SYSTEM ---
-            if "government" in header_clean and "transitional" not in header_clean:
-                if data['political_system'] is None:
-                    links = td.find_all('a')
-                    # Filter out references [1] and citations
-                    valid_links = [
-                        a.get_text() for a in links
-                        if not a.get_text().startswith('[') and not a.get_text()[0].isdigit()
-                    ]
-
-                    if valid_links:
-                        data['political_system'] = ", ".join(valid_links)
-                    else:
-                        text = self.clean_text(td.get_text())
-                        # Double check: don't save if it looks like a date (starts with digit)
-                        if text and not text[0].isdigit():
-                            data['political_system'] = text
-
-            # --- POPULATION ---
-            if "population" in header_clean or "estimate" in header_clean or "census" in header_clean:
-                if data['population'] is None:
-                    data['population'] = self.parse_number(td.get_text())
-
-            # --- DENSITY ---
-            if "density" in header_clean:
-                data['density'] = self.parse_float(td.get_text())
-
-            # --- AREA ---
-            is_area = "area" in header_clean
-            is_total_km = "total" in header_clean and "km" in td.get_text().lower()
-
-            if (is_area or is_total_km) and data['area_in_km2'] is None:
-                data['area_in_km2'] = self.parse_number(td.get_text())
-
-            # --- LANGUAGE ---
-            if "officiallanguage" in header_clean or "officialandnational" in header_clean or "nationallanguage" in header_clean:
-                data['language'] = self.parse_languages(td)
-
-            # --- TIMEZONE ---
-            if "timezone" in header_clean:
-                raw_text = td.get_text()
-                cleaned_tz = re.split(r'[\[\(]', raw_text)[0]
-
-                data['timezone'] = self.clean_text(cleaned_tz)
-                if "List" in raw_text:
-                    # Extragem doar partea de UTC
-                    match = re.search(r'UTC[+-]\d+', raw_text)
-                    if match:
-                        data['timezone'] = match.group(0)
-                    else:
-                        cleaned_tz = re.split(r'[\[\(]', raw_text)[0]
-                        data['timezone'] = self.clean_text(cleaned_tz)
-                else:
-                    cleaned_tz = re.split(r'[\[\(]', raw_text)[0]
-                    data['timezone'] = self.clean_text(cleaned_tz)
+            header_clean = _letters_only(th.text().lower())
+
+            fields = _HEADER_FIELDS.get(header_clean)
+            if fields is None:
+                fields = _HEADER_FIELDS[header_clean] = _classify_header(header_clean)
+
+            if fields:
+                td_text = td.text()
+                for field in fields:
+                    self._ROW_PARSERS[field](self, td, td_text, data)
 
             # --- SPECIAL CASE: DANISH REALM ---
             # The wiki page for "Danish Realm" has the area divided in regions (Denmark, Greenland, Faroe Islands)
@@ -314,19 +460,19 @@ class CountryScraper:
         print(f"Accessing the main list: {full_url}")
 
         try:
-            response = requests.get(full_url, headers=self.headers, timeout=15)
+            response = self.session.get(full_url, timeout=15)
         except Exception as e:
             print(f"Critical error: list of states: {e}")
             return []
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-
         # Finding all tables of type wikitables
-        tables = soup.find_all('table', {'class': 'wikitable'})
         target_table = None
 
-        for t in tables:
-            headers = t.get_text()
+        for table_html in _iter_tables(response.content, _RE_WIKITABLE_START):
+            t = LexborHTMLParser(table_html).css_first('table.wikitable')
+            if not t:
+                continue
+            headers = t.text()
             if "Common and formal names" in headers and "Membership within the UN" in headers:
                 target_table = t
                 break
@@ -337,17 +483,16 @@ class CountryScraper:
 
         country_links = []
 
-        rows = target_table.find_all('tr')
+        rows = target_table.css('tr')
 
         for tr in rows:
-            td = tr.find('td')
+            td = tr.css_first('td')
             if not td:
                 continue
 
-            links = td.find_all('a')
+            links = td.css('a')
             for link in links:
-                href = link.get('href')
-                title = link.get('title')
+                href = link.attributes.get('href')
 
                 # Filtering
                 if (href and
@@ -375,12 +520,13 @@ if __name__ == "__main__":
 
     print(f"\nScraping {len(links)} countries...")
 
-    for i, link in enumerate(links):
-        print(f"[{i + 1}/{len(links)}] {link}")
+    # The neighbors map is only read from here on, so the workers can share the scraper
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for i, (link, c_data) in enumerate(zip(links, executor.map(scraper.get_country_data, links))):
+            print(f"[{i + 1}/{len(links)}] {link}")
 
-        c_data = scraper.get_country_data(link)
-        if c_data and c_data['name']:
-            all_data.append(c_data)
+            if c_data and c_data['name']:
+                all_data.append(c_data)
 
     with open('states_final.json', 'w', encoding='utf-8') as f:
         json.dump(all_data, f, indent=4, ensure_ascii=False)
@@ -1,9 +1,160 @@
 import sqlite3
 import json
 import os
+from itertools import islice
+import ijson
 
 DB_NAME = "states.db"
 
+# (name, DDL) of the indexes created by add_indexes. None of them is needed while importing,
+# so populate_from_json drops them and they are built once, after the data is loaded.
+# (The UNIQUE indexes on the names stay, INSERT OR IGNORE relies on them.)
+SECONDARY_INDEXES = [
+    # 1. Index for fast country lookups by name (used in /api/country/<name>)
+    ('idx_country_name', "CREATE INDEX IF NOT EXISTS idx_country_name ON countries(name)"),
+    # Case insensitive name lookups (/api/country/<name> compares with COLLATE NOCASE)
+    ('idx_name_nocase', "CREATE INDEX IF NOT EXISTS idx_name_nocase ON countries(name COLLATE NOCASE)"),
+
+    # 2. Indexes for sorting (used in Top 10 routes and test_query)
+    # Descending and covering: the Top 10 is read from the first 10 index entries,
+    # without a sort and without touching the table
+    ('idx_population_cov',
+     "CREATE INDEX IF NOT EXISTS idx_population_cov ON countries(population DESC, name, density, area_km2)"),
+    ('idx_density_cov',
+     "CREATE INDEX IF NOT EXISTS idx_density_cov ON countries(density DESC, name, population, area_km2)"),
+
+    # 3. Index for filtering (used in Search route)
+    ('idx_language_name', "CREATE INDEX IF NOT EXISTS idx_language_name ON languages(name)"),
+    ('idx_neighbor_name', "CREATE INDEX IF NOT EXISTS idx_neighbor_name ON borders(neighbor_name)"),
+
+    # 4. Index for the borders of a country (country_languages is already covered by its primary key).
+    # The entries of a country are ordered by rowid, so its neighbors come out in page order
+    ('idx_borders_cid', "CREATE INDEX IF NOT EXISTS idx_borders_cid ON borders(country_id)"),
+]
+
+# Older indexes replaced by the ones above, removed from existing databases by add_indexes
+SUPERSEDED_INDEXES = ['idx_population', 'idx_density', 'idx_pop_desc', 'idx_density_desc']
+
+# The tables, created by create_schema
+_SCHEMA_SQL = '''
+BEGIN;
+
+-- Main Countries Table
+CREATE TABLE IF NOT EXISTS countries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    capital TEXT,
+    population INTEGER,
+    area_km2 REAL,
+    density REAL,
+    timezone TEXT,
+    political_system TEXT
+);
+
+-- Languages Table (Unique list of all languages in the world)
+CREATE TABLE IF NOT EXISTS languages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+
+-- Join Table: Country <-> Languages (MtoM)
+CREATE TABLE IF NOT EXISTS country_languages (
+    country_id INTEGER,
+    language_id INTEGER,
+    FOREIGN KEY (country_id) REFERENCES countries (id),
+    FOREIGN KEY (language_id) REFERENCES languages (id),
+    PRIMARY KEY (country_id, language_id)
+);
+
+-- Borders Table (OtoM)
+-- id keeps the order the neighbors were inserted in (the wikipedia page order)
+CREATE TABLE IF NOT EXISTS borders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    country_id INTEGER,
+    neighbor_name TEXT,
+    FOREIGN KEY (country_id) REFERENCES countries (id)
+);
+
+COMMIT;
+'''
+
+# Countries are read from the JSON and written in batches of this many entries
+IMPORT_BATCH_SIZE = 500
+
+# Statements of the import, kept as constants so the same SQL text (and its cached
+# compiled statement) is reused on every call
+_INSERT_COUNTRY_SQL = '''
+    INSERT OR IGNORE INTO countries 
+    (name, capital, population, area_km2, density, timezone, political_system)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+_INSERT_LANGUAGE_SQL = "INSERT OR IGNORE INTO languages (name) VALUES (?)"
+# Both take one parameter: a JSON array of [country name, value] pairs. The names are turned
+# into ids inside SQLite (through the UNIQUE name indexes), so Python keeps no id maps
+_INSERT_COUNTRY_LANGUAGES_SQL = '''
+    INSERT OR IGNORE INTO country_languages (country_id, language_id)
+    SELECT c.id, l.id FROM json_each(?) AS pair
+    JOIN countries c ON c.name = json_extract(pair.value, '$[0]')
+    JOIN languages l ON l.name = json_extract(pair.value, '$[1]')
+'''
+_INSERT_BORDERS_SQL = '''
+    INSERT INTO borders (country_id, neighbor_name)
+    SELECT c.id, json_extract(pair.value, '$[1]') FROM json_each(?) AS pair
+    JOIN countries c ON c.name = json_extract(pair.value, '$[0]')
+'''
+
+# Neighbors of a country, by name, in page order (a name lookup, then idx_borders_cid for its borders)
+_NEIGHBORS_SQL = '''
+    SELECT neighbor_name FROM borders 
+    WHERE country_id = (SELECT id FROM countries WHERE name = ?)
+    ORDER BY id
+'''
+
+
+def _country_row(entry):
+    """The countries table row of an entry."""
+    return (
+        entry['name'],
+        entry['capital'],
+        entry['population'],
+        entry['area_in_km2'],
+        entry['density'],
+        entry['timezone'],
+        entry['political_system']
+    )
+
+
+def _language_pairs(entry):
+    """Yield (country name, language name) for every language of the entry."""
+    # Languages are a comma separated string in JSON: "English, French" -> ["English", "French"]
+    if entry.get('language'):
+        for lang_name in entry['language'].split(','):
+            yield entry['name'], lang_name.strip()
+
+
+def _named_entries(entries):
+    """Yield the entries that have a name, reporting the ones that don't."""
+    for entry in entries:
+        if entry.get('name'):
+            yield entry
+        else:
+            print(f"Skipping entry without a name: {entry}")
+
+
+def _batches(entries, size):
+    """Yield lists of up to size entries."""
+    entries = iter(entries)
+    while batch := list(islice(entries, size)):
+        yield batch
+
+
+def _border_pairs(entry):
+    """Yield (country name, neighbor name) for every neighbor of the entry."""
+    # Neighbors are a list in JSON
+    for neighbor in entry.get('neighbors') or ():
+        yield entry['name'], neighbor
+
+
 class DatabaseManager:
     def __init__(self, database):
         self.db_name = database
@@ -12,7 +163,19 @@ class DatabaseManager:
 
     def connect(self):
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = sqlite3.connect(self.db_name, cached_statements=256)
+            # WAL + NORMAL sync for fast writes, larger cache and mmap for the reads
+            self.conn.executescript('''
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                PRAGMA temp_store = MEMORY;
+                PRAGMA cache_size = -20000;
+                PRAGMA mmap_size = 134217728;
+                PRAGMA busy_timeout = 5000;
+                PRAGMA foreign_keys = ON;
+            ''')
+            # Rows can be read by column name (row['name']) as well as by position
+            self.conn.row_factory = sqlite3.Row
             self.cursor = self.conn.cursor()
             print(f"Connected to database: {self.db_name}")
         except sqlite3.Error as e:
@@ -24,50 +187,8 @@ class DatabaseManager:
             print("Database connection closed.")
 
     def create_schema(self):
-        # Main Countries Table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS countries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            capital TEXT,
-            population INTEGER,
-            area_km2 REAL,
-            density REAL,
-            timezone TEXT,
-            political_system TEXT
-        )
-        ''')
-
-        # Languages Table (Unique list of all languages in the world)
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS languages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
-        )
-        ''')
-
-        # Join Table: Country <-> Languages (MtoM)
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS country_languages (
-            country_id INTEGER,
-            language_id INTEGER,
-            FOREIGN KEY (country_id) REFERENCES countries (id),
-            FOREIGN KEY (language_id) REFERENCES languages (id),
-            PRIMARY KEY (country_id, language_id)
-        )
-        ''')
-
-        # Borders Table (OtoM)
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS borders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            country_id INTEGER,
-            neighbor_name TEXT,
-            FOREIGN KEY (country_id) REFERENCES countries (id)
-        )
-        ''')
-
-        self.conn.commit()
+        # All the tables in one script, created in a single transaction
+        self.conn.executescript(_SCHEMA_SQL)
         print("Tables created successfully.")
 
     def populate_from_json(self, json_file):
@@ -76,104 +197,93 @@ class DatabaseManager:
             print(f"Error: {json_file} not found.")
             return
 
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        print(f"Importing {len(data)} countries into database...")
-
-        for entry in data:
-            try:
-                self.cursor.execute('''
-                    INSERT OR IGNORE INTO countries 
-                    (name, capital, population, area_km2, density, timezone, political_system)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    entry['name'],
-                    entry['capital'],
-                    entry['population'],
-                    entry['area_in_km2'],
-                    entry['density'],
-                    entry['timezone'],
-                    entry['political_system']
-                ))
-
-                # Get the ID of the country we just inserted
-                # If ignore was triggered (duplicate), we need to fetch the ID manually
-                self.cursor.execute("SELECT id FROM countries WHERE name = ?", (entry['name'],))
-                country_id = self.cursor.fetchone()[0]
-
-                # Process Languages (Comma separated string in JSON)
-                if entry.get('language'):
-                    # "English, French" -> ["English", "French"]
-                    langs = [l.strip() for l in entry['language'].split(',')]
-
-                    for lang_name in langs:
-                        # Insert language into languages table (if it does not exist)
-                        self.cursor.execute("INSERT OR IGNORE INTO languages (name) VALUES (?)", (lang_name,))
-
-                        # Get language ID
-                        self.cursor.execute("SELECT id FROM languages WHERE name = ?", (lang_name,))
-                        lang_id = self.cursor.fetchone()[0]
-
-                        # Link in koin Table
-                        self.cursor.execute('''
-                            INSERT OR IGNORE INTO country_languages (country_id, language_id) 
-                            VALUES (?, ?)
-                        ''', (country_id, lang_id))
-
-                # Process Neighbors (List in JSON)
-                if entry.get('neighbors'):
-                    for neighbor in entry['neighbors']:
-                        self.cursor.execute('''
-                            INSERT INTO borders (country_id, neighbor_name)
-                            VALUES (?, ?)
-                        ''', (country_id, neighbor))
-
-            except sqlite3.Error as e:
-                print(f"Error inserting {entry['name']}: {e}")
-
-        self.conn.commit()
-        print("Data population complete.")
+        print(f"Importing countries from {json_file} into database...")
+
+        # The ids come straight from the tables we just filled, so the foreign keys aren't checked
+        # row by row during the load (the pragma can only be changed outside a transaction)
+        self.conn.execute("PRAGMA foreign_keys = OFF")
+
+        # One explicit transaction for the whole import: a single commit (and fsync) at the end,
+        # and nothing is left half imported if something unexpected fails
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Don't maintain the secondary indexes row by row, add_indexes rebuilds them afterwards
+            for index_name, _ in SECONDARY_INDEXES:
+                self.cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+            count = 0
+
+            # ijson parses the file one country at a time and the rows are written batch by batch,
+            # so only one batch of entries (and its languages and borders) is in memory at a time
+            # (use_float: numbers come as float instead of Decimal, which sqlite3 can't bind)
+            with open(json_file, 'rb') as f:
+                entries = _named_entries(ijson.items(f, 'item', use_float=True))
+                for batch in _batches(entries, IMPORT_BATCH_SIZE):
+                    # Duplicated names are ignored, their languages and neighbors go to the first entry
+                    self.cursor.executemany(_INSERT_COUNTRY_SQL, map(_country_row, batch))
+
+                    lang_pairs = [pair for entry in batch for pair in _language_pairs(entry)]
+                    self.cursor.executemany(_INSERT_LANGUAGE_SQL, (
+                        (lang_name,) for lang_name in dict.fromkeys(lang for _, lang in lang_pairs)
+                    ))
+
+                    # Link in join Table. The rows are bound as one JSON array and json_each unpacks it,
+                    # so each table gets a single statement per batch, executed inside SQLite
+                    self.cursor.execute(_INSERT_COUNTRY_LANGUAGES_SQL, (json.dumps(lang_pairs),))
+                    self.cursor.execute(_INSERT_BORDERS_SQL, (json.dumps([
+                        pair for entry in batch for pair in _border_pairs(entry)
+                    ]),))
+
+                    count += len(batch)
+
+            self.conn.commit()
+        except Exception as e:
+            # Whatever went wrong (database, malformed JSON, an entry missing a field), the import
+            # is undone: the rows, and the dropped indexes, come back as they were
+            self.conn.rollback()
+            print(f"Import failed, changes rolled back: {e!r}")
+            raise
+        finally:
+            # Runs after the commit or the rollback (the pragma is ignored inside a transaction)
+            self.conn.execute("PRAGMA foreign_keys = ON")
+
+        # One check of every foreign key at the end, instead of one lookup per inserted row
+        violations = self.cursor.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            print(f"Warning: {len(violations)} rows reference missing countries or languages.")
+
+        print(f"Data population complete: {count} countries imported.")
 
     def test_query(self):
         print("\n--- TEST: Top 10 Populated Countries ---")
+        # Iterating the cursor streams the rows instead of building a list with fetchall
         self.cursor.execute("SELECT name, population FROM countries ORDER BY population DESC LIMIT 10")
-        for row in self.cursor.fetchall():
-            print(f"{row[0]}: {row[1]:,}")
+        for row in self.cursor:
+            print(f"{row['name']}: {row['population']:,}")
 
         print("\n--- TEST: Neighbors of Romania ---")
-        self.cursor.execute('''
-            SELECT neighbor_name FROM borders 
-            JOIN countries ON borders.country_id = countries.id 
-            WHERE countries.name = 'Romania'
-        ''')
-        print([row[0] for row in self.cursor.fetchall()])
+        self.cursor.execute(_NEIGHBORS_SQL, ('Romania',))
+        print([row['neighbor_name'] for row in self.cursor])
 
         print("\n--- TEST: Top 10 Density Population Countries ---")
         self.cursor.execute("SELECT name, density FROM countries ORDER BY density DESC LIMIT 10")
-        for row in self.cursor.fetchall():
-            print(f"{row[0]}: {row[1]:,}")
+        for row in self.cursor:
+            print(f"{row['name']}: {row['density']:,}")
 
     def add_indexes(self):
         print("Optimization: Adding database indexes...")
         try:
-            conn = sqlite3.connect(DB_NAME)
-            cursor = conn.cursor()
-
-            # 1. Index for fast country lookups by name (used in /api/country/<name>)
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_country_name ON countries(name)")
+            for index_name in SUPERSEDED_INDEXES:
+                self.cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
 
-            # 2. Indexes for sorting (used in Top 10 routes)
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_population ON countries(population)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_density ON countries(density)")
+            for _, sql in SECONDARY_INDEXES:
+                self.cursor.execute(sql)
 
-            # 3. Index for filtering (used in Search route)
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_language_name ON languages(name)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_neighbor_name ON borders(neighbor_name)")
+            # Table and index statistics (sqlite_stat1), so the planner knows how selective each index is
+            self.cursor.execute("ANALYZE")
 
-            conn.commit()
+            self.conn.commit()
             print("Indexes added.")
-            conn.close()
 
         except sqlite3.Error as e:
             print(f"❌ Error adding indexes: {e}")
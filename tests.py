@@ -1,15 +1,45 @@
 import unittest
+import gzip
 import json
+import os
+import tempfile
+from unittest import mock
+import requests_cache
 from crawler import CountryScraper
+from database_manager import DatabaseManager, _NEIGHBORS_SQL
 from app import app
 
+# A country page with the parts the scraper has to get right: other tables before and after
+# the infobox, a table nested inside it, <sup> references, and the area under an "Area" / "• Total" pair
+COUNTRY_PAGE = b'''<html><body>
+<h1 id="firstHeading">Republic of Testland</h1>
+<table class="wikitable"><tr><th>Capital</th><td>Wrong City</td></tr></table>
+<table class="infobox ib-country vcard">
+<tr><td><div class="fn org">Testland</div></td></tr>
+<tr><td><table class="nested"><tr><td>Flag</td><td>Coat of arms</td></tr></table></td></tr>
+<tr><th>Capital</th><td><a href="/wiki/Test_City">Test City</a><sup>[1]</sup></td></tr>
+<tr><th>Official languages</th><td><a href="/wiki/English">English</a><sup>[2]</sup><br><a href="/wiki/French">French</a></td></tr>
+<tr><th>Government</th><td><a href="/wiki/Unitary">Unitary</a> <a href="/wiki/Republic">republic</a><sup>[3]</sup></td></tr>
+<tr><th>Area</th></tr>
+<tr><th>&#8226; Total</th><td>238,397<sup>[4]</sup> km<sup>2</sup> (92,046 sq mi) (78th)</td></tr>
+<tr><th>Population</th></tr>
+<tr><th>&#8226; 2021 census</th><td>19,053,815<sup>[5]</sup> (63rd)</td></tr>
+<tr><th>&#8226; Density</th><td>79.9/km<sup>2</sup> (206.9/sq mi)</td></tr>
+<tr><th>Time zone</th><td>UTC+2 (EET)</td></tr>
+</table>
+<table class="wikitable"><tr><th>Capital</th><td>Other City</td></tr></table>
+</body></html>'''
+
+
 class MyTestCase(unittest.TestCase):
     # Setup
-    def setUp(self):
-        """Runs before every test to set up the environment."""
-        self.scraper = CountryScraper()
-        self.app = app.test_client()  # Create a fake browser for testing the API
-        self.app.testing = True
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole class: the scraper and the test client are shared by every test."""
+        # In-memory cache: the unit tests never create wiki_cache.sqlite
+        cls.scraper = CountryScraper(session=requests_cache.CachedSession(backend='memory'))
+        cls.app = app.test_client()  # Create a fake browser for testing the API
+        cls.app.testing = True
 
     # Unit tests (Scraper Logic)
     def test_scraper_number_parsing(self):
@@ -23,6 +53,18 @@ class MyTestCase(unittest.TestCase):
 
         self.assertIsNone(self.scraper.parse_number("No Data"))
 
+    def test_scraper_number_after_notes(self):
+        """Test if notes and references before the value are not taken as the number."""
+        print("[Test] Checking Number Parser with leading notes...")
+
+        self.assertEqual(self.scraper.parse_number("(2020 census) 1,234,567"), 1234567)
+        self.assertEqual(self.scraper.parse_number("[1] 500 km2"), 500)
+        self.assertEqual(self.scraper.parse_float("[1] 500 km2"), 500.0)
+        self.assertEqual(self.scraper.parse_float("(2021) 79.9/km2"), 79.9)
+        self.assertEqual(self.scraper.parse_float("3.[1]02"), 3.02)
+        self.assertEqual(self.scraper.parse_float("12[a](b).5"), 12.5)
+        self.assertEqual(self.scraper.parse_number("19,053,815[5] (63rd)"), 19053815)
+
     def test_scraper_text_cleaning(self):
         """Test if references [1] and newlines are removed."""
         print("[Test] Checking Text Cleaner...")
@@ -30,6 +72,30 @@ class MyTestCase(unittest.TestCase):
         cleaned = self.scraper.clean_text(raw_text)
         self.assertEqual(cleaned, "France")
 
+    def test_scraper_country_page(self):
+        """Test if a country page (fetched through a stubbed session) is parsed into the right data."""
+        print("[Test] Checking Country Page Parser...")
+        scraper = CountryScraper(session=requests_cache.CachedSession(backend='memory'))
+        scraper.neighbors_map = {"Testland": ["Aland", "Bland"]}
+        scraper.session.get = mock.Mock(return_value=mock.Mock(status_code=200, content=COUNTRY_PAGE))
+
+        self.assertEqual(scraper.get_country_data("/wiki/Testland"), {
+            "name": "Testland",
+            "capital": "Test City",
+            "population": 19053815,
+            "area_in_km2": 238397,
+            "density": 79.9,
+            "neighbors": ["Aland", "Bland"],
+            "language": "English, French",
+            "timezone": "UTC+2",
+            "political_system": "Unitary, republic"
+        })
+
+        # Without a name in the infobox, the page title is used
+        untitled_page = COUNTRY_PAGE.replace(b'<div class="fn org">Testland</div>', b'')
+        scraper.session.get.return_value = mock.Mock(status_code=200, content=untitled_page)
+        self.assertEqual(scraper.get_country_data("/wiki/Testland")['name'], "Republic of Testland")
+
     # Integration tests (API Endpoints)
     def test_api_home(self):
         """Check if Homepage returns 200 OK."""
@@ -44,8 +110,29 @@ class MyTestCase(unittest.TestCase):
         response = self.app.get('/api/countries')
 
         self.assertEqual(response.status_code, 200)
-        self.assertTrue(isinstance(response.json, list))
-        self.assertTrue(len(response.json) > 0)
+        data = response.get_json()  # Parsed once, used by both checks
+        self.assertIsInstance(data, list)
+        self.assertGreater(len(data), 0)
+
+    def test_api_countries_gzip(self):
+        """Check if /api/countries is served gzipped when the client accepts it."""
+        print("[Test] Checking gzip on /api/countries...")
+        plain = self.app.get('/api/countries')
+        response = self.app.get('/api/countries', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.json)
+
+    def test_api_statistics(self):
+        """Check if /api/statistics agrees with the list of countries."""
+        print("[Test] Checking /api/statistics...")
+        stats = self.app.get('/api/statistics').json
+        countries = self.app.get('/api/countries').json
+
+        self.assertEqual(stats['total_countries'], len(countries))
+        self.assertEqual(stats['total_population'], sum(c['population'] or 0 for c in countries))
+        self.assertIn('average_density', stats)
 
     def test_api_search_country(self):
         """Check if searching for a specific country returns correct data."""
@@ -55,18 +142,43 @@ class MyTestCase(unittest.TestCase):
         response = self.app.get(f'/api/country/{country_to_test}')
 
         if response.status_code == 200:
-            data = response.json
+            data = response.get_json()
             self.assertEqual(data['name'], country_to_test)
             self.assertIn('capital', data)
         else:
             print(f"Warning: Country '{country_to_test}' not found in DB. Test skipped.")
 
+    def test_api_country_neighbors_order(self):
+        """Check if the neighbors of a country keep the order of the scraped data (page order)."""
+        print("[Test] Checking neighbors order...")
+        with open('states_final.json', encoding='utf-8') as f:
+            scraped = {entry['name']: entry for entry in json.load(f)}
+
+        data = self.app.get('/api/country/Romania').get_json()
+        self.assertEqual(data['neighbors'], scraped['Romania']['neighbors'])
+
     def test_api_search_filter(self):
         """Check the advanced search route."""
         print("[Test] Checking /api/countries/search?language=English...")
         response = self.app.get('/api/countries/search?language=English')
         self.assertEqual(response.status_code, 200)
-        self.assertTrue(isinstance(response.json, list))
+        self.assertIsInstance(response.get_json(), list)
+
+    def test_favicon_etag(self):
+        """Check if the favicon is answered with 304 when the client already has it."""
+        print("[Test] Checking favicon ETag...")
+        response = self.app.get('/favicon.ico')
+        self.assertEqual(response.status_code, 200)
+
+        cached = self.app.get('/favicon.ico', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_api_country_slug(self):
+        """Check if a slug with underscores (United_States) finds the country."""
+        print("[Test] Checking /api/country/United_States...")
+        response = self.app.get('/api/country/United_States')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['name'], "United States")
 
     def test_api_404(self):
         """Check if invalid country returns 404 JSON (not HTML)."""
@@ -75,6 +187,60 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(response.json['error'], "Country not found")
 
+    # Database import
+    def test_import_rolls_back_malformed_entry(self):
+        """Check if an entry missing a field undoes the whole import and leaves the database usable."""
+        print("[Test] Checking import rollback...")
+        with tempfile.TemporaryDirectory() as tmp:
+            json_file = os.path.join(tmp, 'states.json')
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump([
+                    {"name": "Testland", "capital": "Test City", "population": 10, "area_in_km2": 5,
+                     "density": 2.0, "timezone": "UTC+1", "political_system": "Republic",
+                     "language": "English", "neighbors": ["Otherland"]},
+                    {"name": "Brokenland"},  # No capital, population, ...
+                ], f)
+
+            db = DatabaseManager(os.path.join(tmp, 'states.db'))
+            db.connect()
+            db.create_schema()
+            db.add_indexes()
+            try:
+                with self.assertRaises(KeyError):
+                    db.populate_from_json(json_file)
+
+                self.assertFalse(db.conn.in_transaction)
+                self.assertEqual(db.conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+                self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM countries").fetchone()[0], 0)
+                indexes = {row[0] for row in db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+                self.assertIn('idx_population_cov', indexes)
+            finally:
+                db.close()
+
+    def test_import_keeps_neighbors_order(self):
+        """Check if a rebuilt database returns the neighbors in the order they were scraped."""
+        print("[Test] Checking neighbors order after import...")
+        with tempfile.TemporaryDirectory() as tmp:
+            json_file = os.path.join(tmp, 'states.json')
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump([
+                    {"name": "Testland", "capital": None, "population": None, "area_in_km2": None,
+                     "density": None, "timezone": None, "political_system": None, "language": None,
+                     "neighbors": ["Zland", "Aland", "Mland"]},
+                ], f)
+
+            db = DatabaseManager(os.path.join(tmp, 'states.db'))
+            db.connect()
+            try:
+                db.create_schema()
+                db.populate_from_json(json_file)
+                db.add_indexes()
+
+                neighbors = [row[0] for row in db.conn.execute(_NEIGHBORS_SQL, ("Testland",))]
+                self.assertEqual(neighbors, ["Zland", "Aland", "Mland"])
+            finally:
+                db.close()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,40 +1,64 @@
+import json
 import sqlite3
 
 
 class DataValidator:
     def __init__(self, db_name='states.db'):
-        self.conn = sqlite3.connect(db_name)
+        # The validator only reads, so it opens the database read-only (and can run while it's being written)
+        self.conn = sqlite3.connect(f'file:{db_name}?mode=ro', uri=True)
         self.cursor = self.conn.cursor()
 
     def run_all_checks(self):
+        # Both reports are built from a single scan of the countries table
+        summary = self.scan_countries()
+        self.check_integrity(summary)
+        self.report_general_stats(summary)
 
-        self.check_integrity()
-        self.report_general_stats()
+    def scan_countries(self):
+        """Reads the countries table once, collecting the rows with missing data and the totals."""
+        # One aggregate query: SQLite does the whole scan and only a single row comes back
+        # (SUM and AVG skip NULLs like the reports expect, the bad names come as a JSON array)
+        self.cursor.execute('''
+            SELECT COUNT(*),
+                   SUM(population),
+                   AVG(density),
+                   json_group_array(name) FILTER (WHERE population IS NULL OR area_km2 IS NULL)
+            FROM countries
+        ''')
+        count, total_pop, average_density, bad_names = self.cursor.fetchone()
 
-    def check_integrity(self):
+        return {
+            'bad_names': json.loads(bad_names),
+            'count': count,
+            'total_population': total_pop,
+            'average_density': average_density,
+        }
+
+    def check_integrity(self, summary=None):
         """Checks for missing critical data (NULLs)."""
         print("\n[1] Integrity check (Searching for null data)...")
 
-        self.cursor.execute("SELECT name FROM countries WHERE population IS NULL OR area_km2 IS NULL")
-        bad_rows = self.cursor.fetchall()
+        if summary is None:
+            summary = self.scan_countries()
+        bad_names = summary['bad_names']
 
-        if not bad_rows:
+        if not bad_names:
             print("Passed: All countries have Population and Area data.")
         else:
-            print(f"Fail: Found {len(bad_rows)} countries with missing data:")
-            for row in bad_rows:
-                print(f"   - {row[0]}")
+            print(f"Fail: Found {len(bad_names)} countries with missing data:")
+            for name in bad_names:
+                print(f"   - {name}")
 
-    def report_general_stats(self):
+    def report_general_stats(self, summary=None):
         """Calculates totals and averages."""
         print("\n[2] General stats")
 
-        self.cursor.execute("SELECT COUNT(*), SUM(population), AVG(density) FROM countries")
-        count, total_pop, avg_density = self.cursor.fetchone()
+        if summary is None:
+            summary = self.scan_countries()
 
-        print(f"   - Total Countries Scraped: {count}")
-        print(f"   - Total World Population (in DB): {total_pop:,.0f}")
-        print(f"   - Average Global Density: {avg_density:.2f} people/km^2")
+        print(f"   - Total Countries Scraped: {summary['count']}")
+        print(f"   - Total World Population (in DB): {summary['total_population']:,.0f}")
+        print(f"   - Average Global Density: {summary['average_density']:.2f} people/km^2")
 
     def close(self):
         self.conn.close()